@@ -3,11 +3,20 @@
 ##### Uniqname: guorui
 #################################
 
-from bs4 import BeautifulSoup
-import requests
-import json
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import functools
+import lxml.etree
+import lxml.html
+import httpx
+import pickle
 import secrets  # file that contains your API key
+import shelve
+import sys
+import threading
 import time
+from urllib.parse import urlencode, urlparse
 
 
 class NationalSite:
@@ -32,15 +41,84 @@ class NationalSite:
         the phone of a national site (e.g. '(616) 319-7906', '307-344-7381')
     '''
 
+    __slots__ = ('category', 'name', 'address', 'zipcode', 'phone', '_info')
+
     def __init__(self, category='', name='', address='', zipcode='', phone=''):
         self.category = category
         self.name = name
         self.address = address
         self.zipcode = zipcode
         self.phone = phone
+        self._info = None
 
     def info(self):
-        return f"{self.name} ({self.category}): {self.address} {self.zipcode}"
+        # rendered once and reused when the same sites are listed again
+        if self._info is None:
+            self._info = f"{self.name} ({self.category}): {self.address} {self.zipcode}"
+        return self._info
+
+
+# The state/territory pages never move, so bake the mapping in and skip
+# the index.htm fetch + parse on every startup. _scrape_state_url_dict
+# remains as a fallback if a name is missing from this table.
+_STATE_URLS = {
+    'alabama': 'https://www.nps.gov/state/al/index.htm',
+    'alaska': 'https://www.nps.gov/state/ak/index.htm',
+    'american samoa': 'https://www.nps.gov/state/as/index.htm',
+    'arizona': 'https://www.nps.gov/state/az/index.htm',
+    'arkansas': 'https://www.nps.gov/state/ar/index.htm',
+    'california': 'https://www.nps.gov/state/ca/index.htm',
+    'colorado': 'https://www.nps.gov/state/co/index.htm',
+    'connecticut': 'https://www.nps.gov/state/ct/index.htm',
+    'delaware': 'https://www.nps.gov/state/de/index.htm',
+    'district of columbia': 'https://www.nps.gov/state/dc/index.htm',
+    'florida': 'https://www.nps.gov/state/fl/index.htm',
+    'georgia': 'https://www.nps.gov/state/ga/index.htm',
+    'guam': 'https://www.nps.gov/state/gu/index.htm',
+    'hawaii': 'https://www.nps.gov/state/hi/index.htm',
+    'idaho': 'https://www.nps.gov/state/id/index.htm',
+    'illinois': 'https://www.nps.gov/state/il/index.htm',
+    'indiana': 'https://www.nps.gov/state/in/index.htm',
+    'iowa': 'https://www.nps.gov/state/ia/index.htm',
+    'kansas': 'https://www.nps.gov/state/ks/index.htm',
+    'kentucky': 'https://www.nps.gov/state/ky/index.htm',
+    'louisiana': 'https://www.nps.gov/state/la/index.htm',
+    'maine': 'https://www.nps.gov/state/me/index.htm',
+    'maryland': 'https://www.nps.gov/state/md/index.htm',
+    'massachusetts': 'https://www.nps.gov/state/ma/index.htm',
+    'michigan': 'https://www.nps.gov/state/mi/index.htm',
+    'minnesota': 'https://www.nps.gov/state/mn/index.htm',
+    'mississippi': 'https://www.nps.gov/state/ms/index.htm',
+    'missouri': 'https://www.nps.gov/state/mo/index.htm',
+    'montana': 'https://www.nps.gov/state/mt/index.htm',
+    'nebraska': 'https://www.nps.gov/state/ne/index.htm',
+    'nevada': 'https://www.nps.gov/state/nv/index.htm',
+    'new hampshire': 'https://www.nps.gov/state/nh/index.htm',
+    'new jersey': 'https://www.nps.gov/state/nj/index.htm',
+    'new mexico': 'https://www.nps.gov/state/nm/index.htm',
+    'new york': 'https://www.nps.gov/state/ny/index.htm',
+    'north carolina': 'https://www.nps.gov/state/nc/index.htm',
+    'north dakota': 'https://www.nps.gov/state/nd/index.htm',
+    'northern mariana islands': 'https://www.nps.gov/state/mp/index.htm',
+    'ohio': 'https://www.nps.gov/state/oh/index.htm',
+    'oklahoma': 'https://www.nps.gov/state/ok/index.htm',
+    'oregon': 'https://www.nps.gov/state/or/index.htm',
+    'pennsylvania': 'https://www.nps.gov/state/pa/index.htm',
+    'puerto rico': 'https://www.nps.gov/state/pr/index.htm',
+    'rhode island': 'https://www.nps.gov/state/ri/index.htm',
+    'south carolina': 'https://www.nps.gov/state/sc/index.htm',
+    'south dakota': 'https://www.nps.gov/state/sd/index.htm',
+    'tennessee': 'https://www.nps.gov/state/tn/index.htm',
+    'texas': 'https://www.nps.gov/state/tx/index.htm',
+    'utah': 'https://www.nps.gov/state/ut/index.htm',
+    'vermont': 'https://www.nps.gov/state/vt/index.htm',
+    'virgin islands': 'https://www.nps.gov/state/vi/index.htm',
+    'virginia': 'https://www.nps.gov/state/va/index.htm',
+    'washington': 'https://www.nps.gov/state/wa/index.htm',
+    'west virginia': 'https://www.nps.gov/state/wv/index.htm',
+    'wisconsin': 'https://www.nps.gov/state/wi/index.htm',
+    'wyoming': 'https://www.nps.gov/state/wy/index.htm',
+}
 
 
 def build_state_url_dict():
@@ -56,48 +134,117 @@ def build_state_url_dict():
         key is a state name and value is the url
         e.g. {'michigan':'https://www.nps.gov/state/mi/index.htm', ...}
     '''
+    return dict(_STATE_URLS)
+
+
+def _scrape_state_url_dict():
+    '''Scrape the state name to url mapping from the nps.gov home page
+
+    Fallback for build_state_url_dict when a state is missing from the
+    static _STATE_URLS table.
+
+    Returns
+    -------
+    dict
+        key is a state name and value is the url
+    '''
     html_text = make_url_request_using_cache("https://www.nps.gov/index.htm", CACHE)
-    soup = BeautifulSoup(html_text, 'html.parser')
-    menu = soup.find('ul', class_="dropdown-menu SearchBar-keywordSearch")
+    strainer = SoupStrainer('ul', class_="dropdown-menu SearchBar-keywordSearch")
+    soup = BeautifulSoup(html_text, 'lxml', parse_only=strainer)
+    menu = soup.select_one('ul.dropdown-menu.SearchBar-keywordSearch')
     state_url_dict = {}
-    for state in menu.find_all('li'):
-        state_url_dict[state.text.lower()] = "https://www.nps.gov" + state.find('a')['href']
+    for state in menu.select('li'):
+        state_url_dict[state.text.lower()] = "https://www.nps.gov" + state.select_one('a')['href']
     return state_url_dict
 
 
+# XPaths compiled once at import time; each is a single C-level tree walk
+# instead of per-tag Python predicate matching.
+_XP_NAME = lxml.etree.XPath(
+    "//div[contains(concat(' ', @class, ' '), ' Hero-titleContainer ')]"
+    "//*[contains(concat(' ', @class, ' '), ' Hero-title ')]")
+_XP_CATEGORY = lxml.etree.XPath(
+    "//div[contains(concat(' ', @class, ' '), ' Hero-titleContainer ')]"
+    "//span[contains(concat(' ', @class, ' '), ' Hero-designation ')]")
+_XP_VCARD_SPANS = lxml.etree.XPath(
+    "//div[contains(concat(' ', @class, ' '), ' vcard ')]//span")
+
+_VCARD_ITEMPROPS = ('addressLocality', 'addressRegion', 'postalCode')
+
+
+def _first_text(nodes, default):
+    '''Text content of the first matched node, or default if none matched
+
+    Parameters
+    ----------
+    nodes: list
+        elements returned by a compiled XPath
+    default: string or None
+        value to use when nothing matched
+
+    Returns
+    -------
+    string or None
+        the text of the first match, or default
+    '''
+    return nodes[0].text_content() if nodes else default
+
+
+def _extract_vcard_fields(doc):
+    '''Collect the contact fields from the vcard block in one pass
+
+    A single walk over the vcard spans dispatching on itemprop/class
+    replaces one full-tree XPath evaluation per field.
+
+    Parameters
+    ----------
+    doc: lxml.html.HtmlElement
+        parsed site page
+
+    Returns
+    -------
+    dict
+        itemprop (or 'tel') mapped to text, for the fields present
+    '''
+    fields = {}
+    for span in _XP_VCARD_SPANS(doc):
+        itemprop = span.get('itemprop')
+        if itemprop in _VCARD_ITEMPROPS:
+            fields.setdefault(itemprop, span.text_content())
+        elif 'tel' in (span.get('class') or '').split():
+            fields.setdefault('tel', span.text_content())
+    return fields
+
+
 def get_site_instance(site_url):
     '''Make an instances from a national site URL.
-    
+
     Parameters
     ----------
     site_url: string
         The URL for a national site page in nps.gov
-    
+
     Returns
     -------
     instance
         a national site instance
     '''
     html_text = make_url_request_using_cache(site_url, CACHE)
-    soup = BeautifulSoup(html_text, 'html.parser')
-    title = soup.find("div", class_='Hero-titleContainer clearfix')
-    name = title.find(class_="Hero-title").text
-    category = title.find('span', class_='Hero-designation').text
-
-    contact = soup.find("div", class_='vcard')
-    try:
-        address = contact.find('span', itemprop="addressLocality").text + ', ' + contact.find('span',
-                                                                                              itemprop="addressRegion").text
-    except:
+    doc = lxml.html.fromstring(html_text)
+    name = _first_text(_XP_NAME(doc), '')
+    category = _first_text(_XP_CATEGORY(doc), '')
+
+    fields = _extract_vcard_fields(doc)
+    locality = fields.get('addressLocality')
+    region = fields.get('addressRegion')
+    if locality is not None and region is not None:
+        address = locality + ', ' + region
+    else:
         address = "no address"
-    try:
-        postcode = contact.find('span', itemprop='postalCode').text.strip()
-    except:
-        postcode = "no zipcode"
-    try:
-        phone = contact.find('span', class_="tel").text.strip()
-    except:
-        phone = "no phone"
+    postcode = fields.get('postalCode')
+    postcode = postcode.strip() if postcode is not None else "no zipcode"
+    phone = fields.get('tel')
+    phone = phone.strip() if phone is not None else "no phone"
     return NationalSite(category, name, address, postcode, phone)
 
 
@@ -115,24 +262,31 @@ def get_sites_for_state(state_url):
         a list of national site instances
     '''
     html_text = make_url_request_using_cache(state_url, CACHE)
-    soup = BeautifulSoup(html_text, 'html.parser')
-    parks = soup.find('ul', id="list_parks")
-    instances = []
-    for park in parks.find_all('li', class_='clearfix'):
-        href = park.find('h3').find('a')['href']
-        url = f'https://www.nps.gov/{href}/index.htm'
-        instances.append(get_site_instance(url))
+    strainer = SoupStrainer('ul', id="list_parks")
+    soup = BeautifulSoup(html_text, 'lxml', parse_only=strainer)
+    parks = soup.select_one('ul#list_parks')
+    urls = []
+    for park in parks.select('li.clearfix'):
+        href = park.select_one('h3 a')['href']
+        urls.append(f'https://www.nps.gov/{href}/index.htm')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        instances = list(executor.map(get_site_instance, urls))
     return instances
 
 
-def get_nearby_places(site_object):
-    '''Obtain API data from MapQuest API.
-    
+@functools.lru_cache(maxsize=256)
+def _nearby(zipcode):
+    '''Look up places near a zipcode, memoized in memory
+
+    Sites sharing a zipcode produce identical API requests, so an LRU
+    keyed on the zipcode alone answers repeats without touching the
+    disk cache or the network.
+
     Parameters
     ----------
-    site_object: object
-        an instance of a national site
-    
+    zipcode: string
+        the zip-code to search around
+
     Returns
     -------
     dict
@@ -140,51 +294,89 @@ def get_nearby_places(site_object):
     '''
     params = {
         'key': secrets.API_KEY,
-        'origin': site_object.zipcode,
+        'origin': zipcode,
         'radius': 10,
         'maxMatches': 10,
         'ambiguities': 'ignore',
         'outFormat': 'json'
     }
     baseurl = "http://www.mapquestapi.com/search/v2/radius"
-    response = make_api_request_using_cache(baseurl, params, CACHE)
-    return response
+    return make_api_request_using_cache(baseurl, params, CACHE)
 
 
-def load_cache():
-    '''Load cache file
+def get_nearby_places(site_object):
+    '''Obtain API data from MapQuest API.
+
+    Parameters
+    ----------
+    site_object: object
+        an instance of a national site
 
     Returns
     -------
     dict
-        cache file
+        a converted API return from MapQuest API
+    '''
+    return _nearby(site_object.zipcode)
+
+
+def load_cache():
+    '''Open the cache key-value store
+
+    Each insert is written incrementally by shelve, so there is no
+    full-file parse on startup and no full rewrite per new entry.
+
+    Returns
+    -------
+    shelve.Shelf
+        dict-like persistent cache
     '''
     try:
-        cache_file = open(CACHE_FILE_NAME, 'r')
-        cache_file_contents = cache_file.read()
-        cache = json.loads(cache_file_contents)
-        cache_file.close()
-    except:
-        cache = {}
-    return cache
+        return shelve.open(CACHE_FILE_NAME, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # unreadable or corrupt cache: recreate it empty, like the old
+        # JSON loader did. The stdlib dbm.dumb backend raises more than
+        # dbm.error here (e.g. SyntaxError from its corrupt .dir index).
+        return shelve.open(CACHE_FILE_NAME, flag='n', protocol=pickle.HIGHEST_PROTOCOL)
 
 
-def save_cache(cache):
-    '''Save cache file
+def _host_semaphore(host):
+    '''Get the semaphore capping concurrent fetches to a host
 
     Parameters
     ----------
-    cache: dict
-        cache file
+    host: string
+        hostname taken from the request url
+
+    Returns
+    -------
+    threading.BoundedSemaphore
+        semaphore shared by all fetches to that host
+    '''
+    with _THROTTLE_LOCK:
+        semaphore = _HOST_SEMAPHORES.get(host)
+        if semaphore is None:
+            semaphore = _HOST_SEMAPHORES[host] = threading.BoundedSemaphore(HOST_MAX_CONCURRENCY)
+    return semaphore
+
+
+def _throttle(host):
+    '''Sleep only for whatever is left of RATE_LIMIT_INTERVAL since the
+    last fetch to the same host, instead of a fixed sleep per request
+
+    Parameters
+    ----------
+    host: string
+        hostname taken from the request url
 
     Returns
     -------
     none
     '''
-    cache_file = open(CACHE_FILE_NAME, 'w')
-    contents_to_write = json.dumps(cache)
-    cache_file.write(contents_to_write)
-    cache_file.close()
+    delay = RATE_LIMIT_INTERVAL - (time.monotonic() - _LAST_FETCH_TS.get(host, 0.0))
+    if delay > 0:
+        time.sleep(delay)
+    _LAST_FETCH_TS[host] = time.monotonic()
 
 
 def make_url_request_using_cache(url, cache):
@@ -194,24 +386,26 @@ def make_url_request_using_cache(url, cache):
     ----------
     url: string
         url to get
-    cache: dict
-        cache file
+    cache: shelve.Shelf
+        persistent cache
 
     Returns
     -------
     string
         html content
     '''
-    if (url in cache.keys()):  # the url is our unique key
-        print("Using cache")
-        return cache[url]
-    else:
+    html_text = cache.get(url, _CACHE_MISS)  # the url is our unique key
+    if html_text is _CACHE_MISS:
         print("Fetching")
-        time.sleep(1)
-        response = requests.get(url)
-        cache[url] = response.text
-        save_cache(cache)
-        return cache[url]
+        host = urlparse(url).netloc
+        with _host_semaphore(host):
+            _throttle(host)
+            html_text = CLIENT.get(url).text
+        with CACHE_LOCK:
+            cache[url] = html_text
+    else:
+        print("Using cache")
+    return html_text
 
 
 def construct_unique_key(baseurl, params):
@@ -230,11 +424,8 @@ def construct_unique_key(baseurl, params):
     string
         the unique key as a string
     '''
-    key = baseurl
-    for k, v in params.items():
-        if k != 'key':
-            key += f"_{k}_{v}"
-    return key
+    items = sorted((k, v) for k, v in params.items() if k != 'key')
+    return baseurl + '?' + urlencode(items)
 
 
 def make_api_request_using_cache(baseurl, params, cache):
@@ -246,8 +437,8 @@ def make_api_request_using_cache(baseurl, params, cache):
         The base url of API request
     params: dict
         API request parameters
-    cache: dict
-        cache file
+    cache: shelve.Shelf
+        persistent cache
 
     Returns
     -------
@@ -255,13 +446,15 @@ def make_api_request_using_cache(baseurl, params, cache):
         json returned by API
     '''
     unique_key = construct_unique_key(baseurl, params)
-    if unique_key not in cache:
+    response = cache.get(unique_key, _CACHE_MISS)
+    if response is _CACHE_MISS:
         print("Fetching")
-        CACHE[unique_key] = requests.get(baseurl, params).json()
-        save_cache(CACHE)
+        response = CLIENT.get(baseurl, params=params).json()
+        with CACHE_LOCK:
+            cache[unique_key] = response
     else:
         print('Using Cache')
-    return CACHE[unique_key]
+    return response
 
 
 def list_sites(state, sites):
@@ -279,11 +472,11 @@ def list_sites(state, sites):
     none
     '''
     header = f"List of national sites in {state}"
-    print("-" * len(header))
-    print(header)
-    print("-" * len(header))
+    divider = "-" * len(header)
+    lines = [divider, header, divider]
     for i, site in enumerate(sites):
-        print(f"[{i + 1}] {site.info()}")
+        lines.append(f"[{i + 1}] {site.info()}")
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
 def list_places(site, places):
@@ -301,25 +494,39 @@ def list_places(site, places):
     none
     '''
     header = f"Places near in {site.name}"
-    print("-" * len(header))
-    print(header)
-    print("-" * len(header))
+    divider = "-" * len(header)
+    lines = [divider, header, divider]
     for place in places["searchResults"]:
         name = place["name"]
-        city = place["fields"].get("city", "no city")
+        fields = place["fields"]
+        city = fields.get("city", "no city")
         if city == "":
             city = "no city"
-        category = place["fields"].get("group_sic_code_name", "no category")
+        category = fields.get("group_sic_code_name", "no category")
         if category == "":
             category = "no category"
         address = place.get("address", "no address")
         if address == "":
             address = "no address"
-        print(f"- {name} ({category}): {address}, {city}")
+        lines.append(f"- {name} ({category}): {address}, {city}")
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
-CACHE_FILE_NAME = 'cache.json'
+CACHE_FILE_NAME = 'cache.db'
+RATE_LIMIT_INTERVAL = 1.0
+HOST_MAX_CONCURRENCY = 4
+_LAST_FETCH_TS = {}
+_HOST_SEMAPHORES = {}
+_THROTTLE_LOCK = threading.Lock()
+_CACHE_MISS = object()  # sentinel distinguishing a miss from a cached falsy value
 CACHE = load_cache()
+CACHE_LOCK = threading.Lock()
+atexit.register(CACHE.close)
+# http2=True multiplexes the concurrent park-page fetches over a single
+# TLS connection to www.nps.gov instead of one TCP connection each.
+CLIENT = httpx.Client(http2=True, timeout=10, follow_redirects=True,
+                      limits=httpx.Limits(max_connections=16))
+atexit.register(CLIENT.close)
 
 if __name__ == "__main__":
     state_url_dict = build_state_url_dict()
@@ -330,6 +537,8 @@ if __name__ == "__main__":
             user_input = input('Enter a state name (e.g. Michigan, michigan) or "exit":').lower()
             if user_input == 'exit':
                 break
+            if user_input not in state_url_dict:
+                state_url_dict.update(_scrape_state_url_dict())
             if user_input not in state_url_dict:
                 print("[Error] Enter proper state name")
                 print()